@@ -3,6 +3,7 @@ Base Agent - Production-grade autonomous agent implementation
 Implements ReAct (Reasoning + Acting) pattern with multi-step planning
 """
 
+import asyncio
 import logging
 import time
 from abc import ABC, abstractmethod
@@ -309,7 +310,8 @@ class BaseAgent(ABC):
         prompt = self._build_reasoning_prompt(state)
         
         # Call LLM for reasoning
-        response = self.llm.chat.completions.create(
+        response = await asyncio.to_thread(
+            self.llm.chat.completions.create,
             model="llama-3.3-70b-versatile",
             messages=[
                 {
@@ -338,7 +340,8 @@ class BaseAgent(ABC):
         prompt = self._build_action_prompt(thought, state)
         
         # Call LLM to plan action
-        response = self.llm.chat.completions.create(
+        response = await asyncio.to_thread(
+            self.llm.chat.completions.create,
             model="llama-3.3-70b-versatile",
             messages=[
                 {
@@ -593,7 +596,8 @@ Based on the goal and progress, has the goal been FULLY achieved?
 Respond with ONLY: YES or NO
 """
         
-        response = self.llm.chat.completions.create(
+        response = await asyncio.to_thread(
+            self.llm.chat.completions.create,
             model="llama-3.3-70b-versatile",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.0,
@@ -699,7 +703,8 @@ Provide a brief strategy adjustment (1-2 sentences) on how to proceed differentl
 """
         
         try:
-            response = self.llm.chat.completions.create(
+            response = await asyncio.to_thread(
+                self.llm.chat.completions.create,
                 model="llama-3.3-70b-versatile",
                 messages=[
                     {"role": "system", "content": "You are a strategic planner helping an agent recover from errors."},
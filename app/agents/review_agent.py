@@ -3,6 +3,7 @@ PR Review Agent - Autonomous code reviewer
 Can autonomously review PRs, post comments, and take actions
 """
 
+import asyncio
 import logging
 from typing import Any, Dict, List, Optional
 from groq import Groq
@@ -197,7 +198,8 @@ Return JSON format:
 }}
 """
             
-            response = self.llm.chat.completions.create(
+            response = await asyncio.to_thread(
+                self.llm.chat.completions.create,
                 model="llama-3.3-70b-versatile",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.2,
@@ -279,7 +281,8 @@ For EACH vulnerability found, provide:
 If no vulnerabilities, respond with: NO_VULNERABILITIES_FOUND
 """
             
-            response = self.llm.chat.completions.create(
+            response = await asyncio.to_thread(
+                self.llm.chat.completions.create,
                 model="llama-3.3-70b-versatile",
                 messages=[{"role": "user", "content": prompt}],
                 temperature=0.1,  # Very focused for security
@@ -341,7 +344,8 @@ COVERAGE: good|moderate|poor
 ISSUES: List specific files that need tests
 """
         
-        response = self.llm.chat.completions.create(
+        response = await asyncio.to_thread(
+            self.llm.chat.completions.create,
             model="llama-3.3-70b-versatile",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.2,
@@ -397,7 +401,8 @@ Breaking changes include:
 List any breaking changes found, or respond with: NO_BREAKING_CHANGES
 """
                 
-                response = self.llm.chat.completions.create(
+                response = await asyncio.to_thread(
+                    self.llm.chat.completions.create,
                     model="llama-3.3-70b-versatile",
                     messages=[{"role": "user", "content": prompt}],
                     temperature=0.1,
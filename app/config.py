@@ -1,7 +1,8 @@
 """Application configuration"""
 
 import os
-from typing import List, Union
+from functools import lru_cache
+from typing import List, Optional, Union
 from pydantic import field_validator
 from pydantic_settings import BaseSettings
 
@@ -12,6 +13,8 @@ class Settings(BaseSettings):
     # Groq API
     GROQ_API_KEY: str = ""
     GROQ_MODEL: str = "llama-3.3-70b-versatile"  # Updated to current model
+    # Maximum concurrent Groq calls per worker (keep below the account's rate limit)
+    GROQ_MAX_CONCURRENCY: int = 8
     
     # GitHub Integration
     GITHUB_TOKEN: str = ""
@@ -21,7 +24,17 @@ class Settings(BaseSettings):
     AGENT_TIMEOUT_SECONDS: int = 600
     AGENT_MAX_ITERATIONS: int = 15
     
+    # Large-PR analysis: fan out per-file summaries above this many files.
+    # Opt-in: each fanned-out PR costs up to GROQ_FANOUT_MAX_FILES extra Groq
+    # requests (free tier allows 30/minute)
+    GROQ_FANOUT_ENABLED: bool = False
+    GROQ_FANOUT_MIN_FILES: int = 20
+    GROQ_FANOUT_MAX_FILES: int = 5
+    GROQ_FANOUT_CONCURRENCY: int = 5
+    
     # Server
+    # Production start commands (Dockerfile, Procfile, railway.json) run uvicorn with
+    # --loop uvloop --http httptools; both ship with uvicorn[standard]
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = True
@@ -31,6 +44,20 @@ class Settings(BaseSettings):
     
     # Rate limiting
     RATE_LIMIT: int = 30
+    # Rate-limit counter storage; use redis://host:6379 so all workers share counters
+    RATE_LIMIT_STORAGE_URI: str = "memory://"
+    
+    # Request size limit for /analyze bodies (bytes)
+    VALIDATION_MAX_BODY_SIZE: int = 1024 * 1024
+    # Maximum number of PRs accepted by /analyze/batch
+    BATCH_MAX_PRS: int = 20
+    
+    # Response cache
+    MAX_CACHE_SIZE: int = 256
+    
+    # Optional shared analysis cache across workers (needs the redis package), e.g. redis://localhost:6379/0
+    REDIS_URL: Optional[str] = None
+    REDIS_TTL: int = 3600
     
     @field_validator('ALLOWED_ORIGINS')
     @classmethod
@@ -54,4 +81,12 @@ class Settings(BaseSettings):
         case_sensitive = True
 
 
-settings = Settings()
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Get the cached Settings instance
+    
+    Environment parsing happens on first call; use get_settings.cache_clear()
+    to reload (e.g. in tests).
+    """
+    return Settings()
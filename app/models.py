@@ -1,21 +1,33 @@
 """Pydantic models for request/response validation"""
 
 from typing import List, Optional, Dict, Any
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 
 class PRFile(BaseModel):
     """Represents a file changed in the PR"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     filename: str = Field(..., description="File path")
     status: str = Field(..., description="File status: added, modified, removed, renamed")
     additions: int = Field(default=0, description="Number of lines added")
     deletions: int = Field(default=0, description="Number of lines deleted")
     changes: int = Field(default=0, description="Total changes")
     patch: Optional[str] = Field(default=None, description="Git diff patch")
+    
+    @field_validator('patch')
+    @classmethod
+    def validate_patch(cls, v):
+        # The LLM never needs megabytes of diff; keep the head of the patch only
+        if v and len(v) > 8000:
+            return v[:8000] + "... (truncated)"
+        return v
 
 
 class PRCommit(BaseModel):
     """Represents a commit in the PR"""
+    model_config = ConfigDict(frozen=True, extra='ignore')
+    
     sha: str = Field(..., description="Commit SHA")
     message: str = Field(..., description="Commit message")
     author: str = Field(..., description="Commit author")
@@ -25,19 +37,21 @@ class PRAnalyzeRequest(BaseModel):
     """Request model for PR analysis"""
     title: str = Field(..., min_length=1, max_length=500, description="PR title")
     description: Optional[str] = Field(default="", description="PR description/body")
-    files: List[PRFile] = Field(..., min_items=1, description="Changed files")
+    files: List[PRFile] = Field(..., min_length=1, description="Changed files")
     commits: Optional[List[PRCommit]] = Field(default=[], description="PR commits")
     base_branch: Optional[str] = Field(default="main", description="Base branch")
     head_branch: Optional[str] = Field(default="", description="Head branch")
     pr_url: Optional[str] = Field(default="", description="PR URL")
     
-    @validator('files')
+    @field_validator('files')
+    @classmethod
     def validate_files(cls, v):
         if len(v) > 100:
             raise ValueError("Too many files. Maximum 100 files allowed.")
         return v
     
-    @validator('description')
+    @field_validator('description')
+    @classmethod
     def validate_description(cls, v):
         if v and len(v) > 10000:
             return v[:10000] + "... (truncated)"
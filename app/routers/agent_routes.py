@@ -9,7 +9,7 @@ from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 from app.agents import AgentOrchestrator, TaskType
-from app.config import settings
+from app.config import get_settings
 from groq import Groq
 
 router = APIRouter(prefix="/agent", tags=["AI Agent"])
@@ -23,6 +23,7 @@ def get_orchestrator() -> AgentOrchestrator:
     global _orchestrator
     
     if _orchestrator is None:
+        settings = get_settings()
         llm = Groq(api_key=settings.GROQ_API_KEY)
         _orchestrator = AgentOrchestrator(
             llm_client=llm,
@@ -2,27 +2,188 @@
 
 import logging
 import time
-from fastapi import APIRouter, HTTPException, Request
+from typing import Any, AsyncIterator, Dict, List, Optional
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
+from pydantic import TypeAdapter, ValidationError
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
 from app.models import PRAnalyzeRequest, PRAnalyzeResponse, ErrorResponse, PRContext
 from app.services import get_groq_service, get_cache_service
-from app.config import settings
+from app.config import get_settings
 
 logger = logging.getLogger(__name__)
-router = APIRouter()
-limiter = Limiter(key_func=get_remote_address)
+settings = get_settings()
+router = APIRouter(default_response_class=ORJSONResponse)
+limiter = Limiter(key_func=get_remote_address, storage_uri=settings.RATE_LIMIT_STORAGE_URI)
+RATE_LIMIT_STR = f"{settings.RATE_LIMIT}/minute"
+
+# Request-independent part of /analyze response metadata
+_META_BASE = {"model": settings.GROQ_MODEL}
+
+_PR_BATCH_ADAPTER = TypeAdapter(List[PRAnalyzeRequest])
+
+
+def _request_body(schema: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build openapi_extra documenting a JSON request body
+    
+    The routes parse their body in a dependency, so FastAPI can't infer it.
+    Pydantic's local "#/$defs/..." refs don't resolve inside an OpenAPI
+    document, so the (non-recursive) definitions are inlined.
+    """
+    defs = schema.pop("$defs", {})
+    
+    def inline(node):
+        if isinstance(node, dict):
+            ref = node.get("$ref", "")
+            if ref.startswith("#/$defs/"):
+                return inline(defs[ref[len("#/$defs/"):]])
+            return {k: inline(v) for k, v in node.items()}
+        if isinstance(node, list):
+            return [inline(v) for v in node]
+        return node
+    
+    return {
+        "requestBody": {
+            "content": {"application/json": {"schema": inline(schema)}},
+            "required": True
+        }
+    }
+
+
+_PR_REQUEST_BODY = _request_body(PRAnalyzeRequest.model_json_schema())
+_PR_BATCH_REQUEST_BODY = _request_body(_PR_BATCH_ADAPTER.json_schema())
+
+
+async def enforce_body_limit(request: Request):
+    """
+    Reject oversized payloads before the body is validated
+    
+    Runs as a route dependency, so it fires ahead of Pydantic parsing of
+    the (potentially 100-file) PRAnalyzeRequest. Async so FastAPI runs it on
+    the event loop instead of dispatching a header check to the threadpool.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > settings.VALIDATION_MAX_BODY_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Request body too large. Maximum {settings.VALIDATION_MAX_BODY_SIZE} bytes allowed."
+        )
+
+
+async def parse_pr_request(request: Request) -> PRAnalyzeRequest:
+    """
+    Decode and validate the request body in a single pass
+    
+    pydantic-core parses the raw JSON bytes straight into PRAnalyzeRequest,
+    instead of FastAPI's json.loads() to dict followed by model validation.
+    """
+    try:
+        return PRAnalyzeRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        # Match FastAPI's own error shape for body fields
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+
+
+async def parse_pr_batch(request: Request) -> List[PRAnalyzeRequest]:
+    """Decode and validate a JSON array of PRAnalyzeRequest bodies"""
+    try:
+        prs = _PR_BATCH_ADAPTER.validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        )
+    if not prs:
+        raise HTTPException(status_code=400, detail="At least one PR must be provided")
+    if len(prs) > settings.BATCH_MAX_PRS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many PRs in batch. Maximum {settings.BATCH_MAX_PRS} allowed."
+        )
+    # Read by _batch_cost when the rate limit is checked (after dependencies run)
+    request.state.batch_size = len(prs)
+    return prs
+
+
+def _batch_cost(request: Request) -> int:
+    """Charge a batch against the rate limit once per PR it contains"""
+    return getattr(request.state, "batch_size", 1)
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check an If-None-Match header (possibly a list or weak tags) against our ETag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag
+        for tag in if_none_match.split(",")
+    )
+
+
+def _canonicalize(
+    pr_data: PRAnalyzeRequest,
+    max_files: Optional[int] = None,
+    max_commits: Optional[int] = None
+) -> PRAnalyzeRequest:
+    """
+    Build a deterministic view of the PR for prompting
+    
+    Files are sorted by filename (then truncated) and patch line endings are
+    normalized, so the same PR always yields the same prompt and upstream Groq
+    prompt-prefix caching can hit across /analyze and /analyze/quick.
+    Nested models are shared unless their patch needs normalizing.
+    """
+    files = sorted(pr_data.files, key=lambda f: f.filename)[:max_files]
+    files = [
+        f.model_copy(update={"patch": f.patch.replace("\r\n", "\n")})
+        if f.patch and "\r" in f.patch else f
+        for f in files
+    ]
+    return pr_data.model_copy(update={
+        "files": files,
+        "commits": pr_data.commits[:max_commits]
+    })
+
+
+def _sse(event: str, data: Any) -> bytes:
+    """Encode one Server-Sent Event"""
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+
+def _analysis_response(
+    context: PRContext,
+    metadata: dict,
+    headers: Optional[Dict[str, str]] = None
+) -> ORJSONResponse:
+    """
+    Serialize an already-built analysis directly
+    
+    The routes declare response_model=None so FastAPI doesn't re-validate
+    the PRAnalyzeResponse we construct ourselves.
+    """
+    response = PRAnalyzeResponse(success=True, context=context, metadata=metadata)
+    return ORJSONResponse(content=response.model_dump(), headers=headers)
 
 
 @router.post(
     "/analyze",
-    response_model=PRAnalyzeResponse,
+    response_model=None,
+    openapi_extra=_PR_REQUEST_BODY,
+    responses={200: {"model": PRAnalyzeResponse}},
+    dependencies=[Depends(enforce_body_limit)],
     summary="Analyze GitHub PR",
     description="Generate AI-powered context for a GitHub Pull Request"
 )
-@limiter.limit(f"{settings.RATE_LIMIT}/minute")
-async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
+@limiter.limit(RATE_LIMIT_STR)
+async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest = Depends(parse_pr_request)):
     """
     Analyze a GitHub Pull Request and generate comprehensive context
     
@@ -42,30 +203,42 @@ async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
     - Review priority
     - Estimated review time
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
-        logger.info(f"Received PR analysis request: {pr_data.title}")
-        logger.info(f"Files: {len(pr_data.files)}, Commits: {len(pr_data.commits)}")
+        logger.info("Received PR analysis request: %s", pr_data.title)
+        logger.info("Files: %d, Commits: %d", len(pr_data.files), len(pr_data.commits))
         
         # Check cache first
         cache_service = get_cache_service()
-        cached_context = cache_service.get(pr_data)
+        cache_key = cache_service.generate_cache_key(pr_data)
         
-        if cached_context:
-            elapsed_time = time.time() - start_time
-            logger.info(f"Returning CACHED result in {elapsed_time:.2f}s")
+        # Content-derived key doubles as ETag: client already has this analysis.
+        # Only sent with cached analyses, so fallbacks are retried next time
+        etag = f'"{cache_key}"'
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            logger.info("ETag match for key: %s, returning 304", cache_key)
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        cached_json = cache_service.get_json_by_key(cache_key)
+        
+        if cached_json is not None:
+            elapsed_time = time.perf_counter() - start_time
+            logger.info("Returning CACHED result in %.2fs", elapsed_time)
             
-            return PRAnalyzeResponse(
-                success=True,
-                context=cached_context,
-                metadata={
-                    "processing_time": f"{elapsed_time:.2f}s",
-                    "files_analyzed": len(pr_data.files),
-                    "commits_analyzed": len(pr_data.commits),
-                    "model": settings.GROQ_MODEL,
-                    "cached": True
-                }
+            # Splice the pre-encoded context into the PRAnalyzeResponse envelope
+            metadata = orjson.dumps({
+                **_META_BASE,
+                "processing_time": f"{elapsed_time:.2f}s",
+                "files_analyzed": len(pr_data.files),
+                "commits_analyzed": len(pr_data.commits),
+                "cached": True
+            })
+            return Response(
+                content=b'{"success":true,"context":' + cached_json
+                + b',"error":null,"metadata":' + metadata + b'}',
+                media_type="application/json",
+                headers={"ETag": etag}
             )
         
         # Validate request
@@ -79,7 +252,7 @@ async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
         try:
             groq_service = get_groq_service()
         except ValueError as e:
-            logger.error(f"Groq service initialization failed: {e}")
+            logger.error("Groq service initialization failed: %s", e)
             raise HTTPException(
                 status_code=503,
                 detail=str(e)
@@ -87,28 +260,39 @@ async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
         
         # Analyze PR
         try:
-            context = await groq_service.analyze_pr(pr_data)
+            canonical_data = _canonicalize(pr_data)
+            if settings.GROQ_FANOUT_ENABLED and len(pr_data.files) > settings.GROQ_FANOUT_MIN_FILES:
+                # Large PR: concurrent per-file summaries, then one merge prompt
+                context = await groq_service.analyze_files_concurrent(
+                    canonical_data,
+                    concurrency=settings.GROQ_FANOUT_CONCURRENCY,
+                    max_files=settings.GROQ_FANOUT_MAX_FILES,
+                    cache_key=cache_key
+                )
+            else:
+                # The key ignores file order and CRLF, so it's valid for the canonical copy
+                context = await groq_service.analyze_pr(canonical_data, cache_key)
             
-            # Cache the successful result
-            cache_service.set(pr_data, context)
+            elapsed_time = time.perf_counter() - start_time
+            logger.info("Analysis completed in %.2fs", elapsed_time)
             
-            elapsed_time = time.time() - start_time
-            logger.info(f"Analysis completed in {elapsed_time:.2f}s")
+            # Fallback and trivial contexts aren't cached; don't let clients pin them
+            cacheable = cache_service.get_json_by_key(cache_key) is not None
             
-            return PRAnalyzeResponse(
-                success=True,
-                context=context,
-                metadata={
+            return _analysis_response(
+                context,
+                {
+                    **_META_BASE,
                     "processing_time": f"{elapsed_time:.2f}s",
                     "files_analyzed": len(pr_data.files),
                     "commits_analyzed": len(pr_data.commits),
-                    "model": settings.GROQ_MODEL,
                     "cached": False
-                }
+                },
+                headers={"ETag": etag} if cacheable else None
             )
             
         except ValueError as e:
-            logger.error(f"Analysis failed: {e}")
+            logger.error("Analysis failed: %s", e)
             raise HTTPException(
                 status_code=422,
                 detail=f"Analysis failed: {str(e)}"
@@ -117,7 +301,7 @@ async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Unexpected error in analyze_pr: {e}", exc_info=True)
+        logger.error("Unexpected error in analyze_pr: %s", e, exc_info=True)
         raise HTTPException(
             status_code=500,
             detail="Internal server error during analysis"
@@ -126,33 +310,33 @@ async def analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
 
 @router.post(
     "/analyze/quick",
-    response_model=PRAnalyzeResponse,
+    response_model=None,
+    openapi_extra=_PR_REQUEST_BODY,
+    responses={200: {"model": PRAnalyzeResponse}},
+    dependencies=[Depends(enforce_body_limit)],
     summary="Quick PR Analysis (30 seconds mode)",
     description="Generate a quick summary for fast reviews"
 )
-@limiter.limit(f"{settings.RATE_LIMIT}/minute")
-async def quick_analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
+@limiter.limit(RATE_LIMIT_STR)
+async def quick_analyze_pr(request: Request, pr_data: PRAnalyzeRequest = Depends(parse_pr_request)):
     """
     Quick PR analysis for fast reviews
     Returns abbreviated context focusing on key points only
     """
-    start_time = time.time()
+    start_time = time.perf_counter()
     
     try:
-        # Simplified analysis - only use first few files
-        simplified_data = pr_data.model_copy()
-        simplified_data.files = pr_data.files[:10]  # Only first 10 files
-        simplified_data.commits = pr_data.commits[:5]  # Only first 5 commits
+        # Simplified analysis - only first 10 files (by filename) and first 5 commits
+        simplified_data = _canonicalize(pr_data, max_files=10, max_commits=5)
         
         groq_service = get_groq_service()
         context = await groq_service.analyze_pr(simplified_data)
         
-        elapsed_time = time.time() - start_time
+        elapsed_time = time.perf_counter() - start_time
         
-        return PRAnalyzeResponse(
-            success=True,
-            context=context,
-            metadata={
+        return _analysis_response(
+            context,
+            {
                 "processing_time": f"{elapsed_time:.2f}s",
                 "mode": "quick",
                 "files_analyzed": len(simplified_data.files),
@@ -161,8 +345,161 @@ async def quick_analyze_pr(request: Request, pr_data: PRAnalyzeRequest):
         )
         
     except Exception as e:
-        logger.error(f"Quick analysis failed: {e}")
+        logger.error("Quick analysis failed: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Quick analysis failed: {str(e)}"
         )
+
+
+@router.post(
+    "/analyze/batch",
+    response_model=None,
+    openapi_extra=_PR_BATCH_REQUEST_BODY,
+    responses={200: {"content": {"application/x-ndjson": {}}}},
+    dependencies=[Depends(enforce_body_limit)],
+    summary="Batch PR Analysis",
+    description="Analyze several PRs concurrently, streaming each result as soon as it is ready"
+)
+@limiter.limit(RATE_LIMIT_STR, cost=_batch_cost)
+async def analyze_pr_batch(request: Request, prs: List[PRAnalyzeRequest] = Depends(parse_pr_batch)):
+    """
+    Analyze a JSON array of PRs (same shape as /analyze bodies)
+    
+    Responds with newline-delimited JSON, one PRAnalyzeResponse per line in
+    completion order; each line's metadata.index is the PR's position in the
+    request. A failed PR yields a line with success=false and does not stop
+    the rest of the batch.
+    """
+    start_time = time.perf_counter()
+    logger.info("Received batch analysis request: %d PRs", len(prs))
+    
+    try:
+        groq_service = get_groq_service()
+    except ValueError as e:
+        logger.error("Groq service initialization failed: %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail=str(e)
+        )
+    
+    cache_service = get_cache_service()
+    cache_keys = [cache_service.generate_cache_key(pr) for pr in prs]
+    
+    def line(index: int, context: Optional[PRContext], error: Optional[str], cached: bool) -> bytes:
+        response = PRAnalyzeResponse(
+            success=context is not None,
+            context=context,
+            error=error,
+            metadata={
+                **_META_BASE,
+                "index": index,
+                "processing_time": f"{time.perf_counter() - start_time:.2f}s",
+                "files_analyzed": len(prs[index].files),
+                "commits_analyzed": len(prs[index].commits),
+                "cached": cached
+            }
+        )
+        return orjson.dumps(response.model_dump()) + b"\n"
+    
+    async def results() -> AsyncIterator[bytes]:
+        # Serve cache hits immediately; only misses go to Groq
+        pending: List[int] = []
+        for index, cache_key in enumerate(cache_keys):
+            context = cache_service.get_by_key(cache_key)
+            if context is not None:
+                yield line(index, context, None, True)
+            else:
+                pending.append(index)
+        
+        if not pending:
+            return
+        
+        async for i, result in groq_service.analyze_prs(
+            [_canonicalize(prs[index]) for index in pending],
+            [cache_keys[index] for index in pending]
+        ):
+            index = pending[i]
+            if isinstance(result, PRContext):
+                yield line(index, result, None, False)
+            else:
+                logger.error("Batch analysis failed for PR %d: %s", index, result)
+                message = str(result) if isinstance(result, ValueError) else "Internal server error during analysis"
+                yield line(index, None, f"Analysis failed: {message}", False)
+        
+        logger.info("Batch analysis completed in %.2fs", time.perf_counter() - start_time)
+    
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@router.post(
+    "/analyze/stream",
+    response_model=None,
+    openapi_extra=_PR_REQUEST_BODY,
+    responses={200: {"content": {"text/event-stream": {}}}},
+    dependencies=[Depends(enforce_body_limit)],
+    summary="Stream PR Analysis",
+    description="Stream AI-generated PR context as Server-Sent Events while it is generated"
+)
+@limiter.limit(RATE_LIMIT_STR)
+async def stream_analyze_pr(request: Request, pr_data: PRAnalyzeRequest = Depends(parse_pr_request)):
+    """
+    Analyze a GitHub Pull Request, streaming the result as Server-Sent Events
+    
+    - **field** events carry `{"key", "value"}` for each context field as soon as it is generated
+    - a final **context** event carries the full PRAnalyzeResponse (same shape as /analyze)
+    - an **error** event is sent if analysis fails after streaming has started
+    """
+    start_time = time.perf_counter()
+    logger.info("Received streaming PR analysis request: %s", pr_data.title)
+    
+    try:
+        groq_service = get_groq_service()
+    except ValueError as e:
+        logger.error("Groq service initialization failed: %s", e)
+        raise HTTPException(
+            status_code=503,
+            detail=str(e)
+        )
+    
+    cache_service = get_cache_service()
+    cache_key = cache_service.generate_cache_key(pr_data)
+    
+    async def events() -> AsyncIterator[bytes]:
+        try:
+            context = cache_service.get_by_key(cache_key)
+            cached = context is not None
+            
+            if context is None:
+                async for event, payload in groq_service.analyze_pr_stream(_canonicalize(pr_data), cache_key):
+                    if event == "field":
+                        key, value = payload
+                        yield _sse("field", {"key": key, "value": value})
+                    else:
+                        context = payload
+            
+            elapsed_time = time.perf_counter() - start_time
+            logger.info("Streaming analysis completed in %.2fs", elapsed_time)
+            
+            response = PRAnalyzeResponse(
+                success=True,
+                context=context,
+                metadata={
+                    **_META_BASE,
+                    "processing_time": f"{elapsed_time:.2f}s",
+                    "files_analyzed": len(pr_data.files),
+                    "commits_analyzed": len(pr_data.commits),
+                    "cached": cached
+                }
+            )
+            yield _sse("context", response.model_dump())
+            
+        except ValueError as e:
+            logger.error("Streaming analysis failed: %s", e)
+            yield _sse("error", {"detail": f"Analysis failed: {str(e)}"})
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"}
+    )
@@ -2,130 +2,169 @@
 Response caching service to reduce API calls and improve performance
 """
 
-import hashlib
-import json
 import time
 import logging
+import orjson
+import xxhash
+from collections import OrderedDict
 from typing import Optional, Dict, Any
+from app.config import get_settings
 from app.models import PRAnalyzeRequest, PRContext
 
 logger = logging.getLogger(__name__)
 
 
+class _CacheEntry:
+    """Cache slot holding a PRContext and its pre-encoded JSON"""
+    __slots__ = ("data", "json", "timestamp", "pr_title")
+    
+    def __init__(self, data: PRContext, json: bytes, timestamp: float, pr_title: str):
+        self.data = data
+        self.json = json
+        self.timestamp = timestamp
+        self.pr_title = pr_title
+
+
 class CacheService:
-    """In-memory cache for PR analysis results"""
+    """In-memory LRU cache for PR analysis results"""
     
-    def __init__(self, ttl_seconds: int = 3600):
+    def __init__(self, ttl_seconds: int = 3600, max_size: int = 256):
         """
         Initialize cache service
         
         Args:
             ttl_seconds: Time-to-live for cache entries (default: 1 hour)
+            max_size: Maximum number of entries before LRU eviction (default: 256)
         """
-        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._cache: "OrderedDict[str, _CacheEntry]" = OrderedDict()
         self._ttl = ttl_seconds
-        logger.info(f"Cache service initialized with TTL: {ttl_seconds}s")
+        self._max_size = max_size
+        logger.info("Cache service initialized with TTL: %ds, max size: %d", ttl_seconds, max_size)
     
-    def _generate_cache_key(self, pr_data: PRAnalyzeRequest) -> str:
+    def generate_cache_key(self, pr_data: PRAnalyzeRequest) -> str:
         """
         Generate unique cache key from PR data
         
-        Uses title, file count, and total changes to create hash
-        This means same PR with same changes = cache hit
+        Covers everything that feeds the analysis prompt (title, description,
+        branches, every file including its patch, commit messages), so a new
+        push to the same PR = cache miss. File order and patch line endings
+        don't matter, matching the router's canonical view of the PR.
+        The key is also the /analyze ETag and the shared (Redis) cache key.
         """
-        # Create deterministic representation
-        cache_input = {
-            "title": pr_data.title,
-            "files": len(pr_data.files),
-            "total_additions": sum(f.additions for f in pr_data.files),
-            "total_deletions": sum(f.deletions for f in pr_data.files),
-            # Include first 3 filenames for more specificity
-            "sample_files": [f.filename for f in pr_data.files[:3]]
-        }
+        # Stream fields straight into the hasher (no intermediate string),
+        # each length-prefixed so field boundaries can't collide
+        hasher = xxhash.xxh3_128()
+        
+        def put(value: Optional[str]):
+            data = (value or "").encode()
+            hasher.update(len(data).to_bytes(4, "little"))
+            hasher.update(data)
+        
+        put(pr_data.title)
+        put(pr_data.description)
+        put(pr_data.base_branch)
+        put(pr_data.head_branch)
+        
+        hasher.update(len(pr_data.files).to_bytes(4, "little"))
+        for f in sorted(pr_data.files, key=lambda f: f.filename):
+            put(f.filename)
+            put(f.status)
+            hasher.update(f.additions.to_bytes(8, "little", signed=True))
+            hasher.update(f.deletions.to_bytes(8, "little", signed=True))
+            patch = f.patch
+            put(patch.replace("\r\n", "\n") if patch and "\r" in patch else patch)
+        
+        hasher.update(len(pr_data.commits).to_bytes(4, "little"))
+        for message in sorted(c.message for c in pr_data.commits):
+            put(message)
         
-        # Generate SHA256 hash
-        cache_str = json.dumps(cache_input, sort_keys=True)
-        cache_key = hashlib.sha256(cache_str.encode()).hexdigest()[:16]
+        cache_key = hasher.hexdigest()
         
-        logger.debug(f"Generated cache key: {cache_key} for PR: {pr_data.title}")
+        logger.debug("Generated cache key: %s for PR: %s", cache_key, pr_data.title)
         return cache_key
     
-    def get(self, pr_data: PRAnalyzeRequest) -> Optional[PRContext]:
+    def get_by_key(self, cache_key: str) -> Optional[PRContext]:
+        """Look up a cached PRContext by key"""
+        entry = self._get_entry(cache_key)
+        return entry.data if entry else None
+    
+    def get_json_by_key(self, cache_key: str) -> Optional[bytes]:
         """
-        Get cached analysis if available and not expired
+        Look up the pre-encoded JSON of a cached PRContext by key
         
-        Returns:
-            Cached PRContext or None if not found/expired
+        Lets cache hits skip re-serializing the (immutable) context.
         """
-        cache_key = self._generate_cache_key(pr_data)
-        
-        if cache_key not in self._cache:
-            logger.debug(f"Cache MISS for key: {cache_key}")
+        entry = self._get_entry(cache_key)
+        return entry.json if entry else None
+    
+    def _get_entry(self, cache_key: str) -> Optional[_CacheEntry]:
+        """Look up a cache entry by key, dropping it if expired"""
+        entry = self._cache.get(cache_key)
+        if entry is None:
+            logger.debug("Cache MISS for key: %s", cache_key)
             return None
         
-        entry = self._cache[cache_key]
-        age = time.time() - entry["timestamp"]
+        age = time.perf_counter() - entry.timestamp
         
         # Check if expired
         if age > self._ttl:
-            logger.info(f"Cache EXPIRED for key: {cache_key} (age: {age:.1f}s)")
+            logger.info("Cache EXPIRED for key: %s (age: %.1fs)", cache_key, age)
             del self._cache[cache_key]
             return None
         
-        logger.info(f"Cache HIT for key: {cache_key} (age: {age:.1f}s)")
-        return entry["data"]
+        # Mark as most recently used
+        self._cache.move_to_end(cache_key)
+        logger.info("Cache HIT for key: %s (age: %.1fs)", cache_key, age)
+        return entry
     
-    def set(self, pr_data: PRAnalyzeRequest, context: PRContext):
+    def set_with_key(self, cache_key: str, context: PRContext, pr_title: str = "Unknown"):
         """
-        Store analysis result in cache
+        Store analysis result under a key from generate_cache_key()
         """
-        cache_key = self._generate_cache_key(pr_data)
+        entry = _CacheEntry(
+            data=context,
+            json=orjson.dumps(context.model_dump()),
+            timestamp=time.perf_counter(),
+            pr_title=pr_title
+        )
+        self._store(cache_key, entry)
         
-        self._cache[cache_key] = {
-            "data": context,
-            "timestamp": time.time(),
-            "pr_title": pr_data.title
-        }
-        
-        logger.info(f"Cached analysis for key: {cache_key} (PR: {pr_data.title})")
-        
-        # Optional: Cleanup old entries (prevent memory bloat)
-        self._cleanup_expired()
+        logger.info("Cached analysis for key: %s (PR: %s)", cache_key, pr_title)
     
-    def _cleanup_expired(self):
-        """Remove expired entries from cache"""
-        now = time.time()
-        expired_keys = [
-            key for key, entry in self._cache.items()
-            if now - entry["timestamp"] > self._ttl
-        ]
-        
-        for key in expired_keys:
-            logger.debug(f"Removing expired cache entry: {key}")
-            del self._cache[key]
+    def _store(self, cache_key: str, entry: _CacheEntry):
+        """Insert an entry as most recently used, evicting the LRU entry if over capacity"""
+        if cache_key in self._cache:
+            self._cache.move_to_end(cache_key)
+        self._cache[cache_key] = entry
+        
+        # Evict least recently used entry (expiry is checked lazily on get)
+        if len(self._cache) > self._max_size:
+            evicted_key, _ = self._cache.popitem(last=False)
+            logger.debug("Evicted LRU cache entry: %s", evicted_key)
     
     def clear(self):
         """Clear all cache entries"""
         count = len(self._cache)
         self._cache.clear()
-        logger.info(f"Cache cleared: {count} entries removed")
+        logger.info("Cache cleared: %d entries removed", count)
     
     def stats(self) -> Dict[str, Any]:
         """Get cache statistics"""
-        now = time.time()
+        now = time.perf_counter()
         entries = []
         
         for key, entry in self._cache.items():
-            age = now - entry["timestamp"]
+            age = now - entry.timestamp
             entries.append({
                 "key": key,
                 "age_seconds": int(age),
-                "pr_title": entry.get("pr_title", "Unknown")
+                "pr_title": entry.pr_title
             })
         
         return {
             "total_entries": len(self._cache),
             "ttl_seconds": self._ttl,
+            "max_size": self._max_size,
             "entries": entries
         }
 
@@ -138,5 +177,8 @@ def get_cache_service() -> CacheService:
     """Get singleton cache service instance"""
     global _cache_service
     if _cache_service is None:
-        _cache_service = CacheService(ttl_seconds=3600)  # 1 hour default
+        _cache_service = CacheService(
+            ttl_seconds=3600,  # 1 hour default
+            max_size=get_settings().MAX_CACHE_SIZE
+        )
     return _cache_service
@@ -1,290 +1,834 @@
 """Groq AI service for PR analysis"""
 
-import json
+import asyncio
+import heapq
 import logging
+import os
+import threading
 import time
-from typing import Dict, Any, Optional
-from groq import Groq, GroqError
-from app.config import settings
-from app.models import PRAnalyzeRequest, PRContext
+from typing import Dict, Any, AsyncIterator, List, Optional, Tuple, Union
+from cachetools import LRUCache
+import httpx
+import orjson
+from groq import AsyncGroq, BadRequestError, GroqError, RateLimitError
+from pydantic import ValidationError
+try:
+    import redis.asyncio as aioredis
+except ImportError:
+    aioredis = None
+from app.config import get_settings
+from app.models import PRAnalyzeRequest, PRContext, PRFile
+from app.services.cache_service import get_cache_service
 
 logger = logging.getLogger(__name__)
 
+_RATE_LIMIT_MESSAGE = (
+    "Groq API rate limit exceeded. Please try again in a few minutes. "
+    "Free tier: 80,000 tokens/day, 30 requests/minute."
+)
+
+# Filenames the extension sends when only summary data is available (Conversation tab)
+_SUMMARY_PREFIXES = ('[', 'SUMMARY', 'LIMITATION', 'ℹ️')
+
+# How long to bypass Redis after a connection/command failure
+_REDIS_RETRY_SECONDS = 30.0
+
+# Documentation/image extensions whose small changes can skip the AI review.
+# Allowlist: config, CI workflows, .txt (requirements.txt, CMakeLists.txt) and
+# extensionless files (Dockerfile, Makefile) always get analyzed
+_DOC_EXTS = frozenset({
+    '.md', '.markdown', '.rst', '.adoc',
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.ico'
+})
+
+# PRs within these limits (and touching only documentation files) skip the Groq call
+_TRIVIAL_MAX_FILES = 2
+_TRIVIAL_MAX_CHANGES = 20
+
+# PR-independent instructions, sent byte-identical as the system message on every
+# call so the prefix stays stable (enables upstream prompt-prefix caching)
+_STATIC_SYSTEM_PROMPT = """You are a senior staff engineer performing an expert code review that will guide engineering decisions. Your analysis must be specific, professional and actionable.
+
+Rules:
+- Be specific to THIS PR: cite actual files from FILES CHANGED when available, otherwise infer the changes from the title and description (follow the DATA CONTEXT note).
+- Use the actual numbers from CODE CHANGE STATISTICS (additions, deletions, total lines, file count). Never say "0 lines" or "no files modified" when the stats show otherwise.
+- Show architectural insight and give concrete steps, using precise technical terminology.
+- No generic advice ("ensure proper testing"), obvious statements ("files were modified") or vague warnings ("might cause problems"). Be specific or don't mention it.
+
+Respond with JSON:
+{
+  "summary": "2-3 sentences citing ACTUAL NUMBERS from 'CODE CHANGE STATISTICS' (additions, deletions and file count). Mention specific files from FILES CHANGED list when available; otherwise infer changes from PR title/description. Example: '<N> files modified with <total> total line changes, focusing on [infer from title] ...'",
+  
+  "purpose": "The ACTUAL technical problem being solved (cite issue numbers from description if present). Example: 'Fixes Issue #XXXXX where [specific problem from title/description]'",
+  
+  "testing_focus": [
+    "SPECIFIC test scenario 1 based on actual changes (e.g., 'Open chat in untitled file, verify session initializes without null errors')",
+    "SPECIFIC scenario 2 with edge case (e.g., 'Rename file during active session, confirm sessionId persists correctly')",
+    "SPECIFIC scenario 3 for regression (e.g., 'Test existing saved-file workflow unchanged')"
+  ],
+  
+  "potential_risks": [
+    "SPECIFIC technical risk from THIS PR (e.g., 'Session API breaking change: sessionId now nullable during init - may break extensions expecting immediate ID')",
+    "SPECIFIC concern with file reference (e.g., 'Large refactor in ErrorHandler.ts could introduce uncaught exceptions in error-handling code itself')"
+  ],
+  
+  "affected_areas": [
+    "Specific module/file with role (e.g., 'ChatSessionsService.ts - core session lifecycle')",
+    "API/component changed (e.g., 'POST /api/sessions endpoint - validates sessionId')",
+    "Database/state impact (e.g., 'Session storage schema - adds optional fallback_id field')"
+  ],
+  
+  "review_priority": "HIGH/MEDIUM/LOW/CRITICAL with detailed justification. MUST reference actual change volume (Net Change Volume lines, Total Files). Example: 'MEDIUM - Modifies <N> files with <total> line changes in [area from title], affecting [component] with [risk level]'",
+  
+  "estimated_review_time": "Realistic minutes based on Net Change Volume. Formula: <200 lines: 10-20min | 200-500: 20-40min | 500-1000: 40-70min | >1000: 70-120min. Adjust for complexity from title/description.",
+  
+  "key_changes": [
+    "SPECIFIC technical change with file + impact (e.g., 'ChatSessionsService.ts: Adds async initSession() method with null-check, replaces sync constructor pattern - breaking change for direct instantiation')",
+    "SPECIFIC change explaining architecture (e.g., 'Introduces SessionValidator middleware (+200 lines) enforcing sessionId validation before all API calls - new security layer')",
+    "SPECIFIC change about performance/security (e.g., 'Removes N+1 query in getActiveSessions() by adding eager loading - 10x performance improvement')",
+    "Continue with 2-5 more SPECIFIC items..."
+  ]
+}
+Respond only with a single JSON object matching this schema. No markdown, no code blocks, no extra text."""
+
+# Appended to the system prompt for the one re-ask after an unparseable response
+_STRICT_JSON_REMINDER = """
+
+Your previous reply was not valid JSON. Output exactly one JSON object with the keys summary, purpose, testing_focus, potential_risks, affected_areas, review_priority, estimated_review_time and key_changes - nothing before or after it."""
+
+# PR-specific user message, filled in by _build_analysis_prompt via format_map
+_PROMPT_TEMPLATE = """PULL REQUEST CONTEXT
+Title: {title}
+Description: {description}
+Base Branch: {base_branch}
+Head Branch: {head_branch}
+
+{stats_section}
+
+FILES CHANGED ({n_files} files):
+{files_text}{file_notes_section}
+
+COMMITS ({n_commits} commits):
+{commits_text}
+
+DATA CONTEXT:
+{data_context}"""
+
+_STATS_TEMPLATE = """
+CODE CHANGE STATISTICS:
+- Total Files: {n_files} files
+- Total Additions: +{total_additions} lines  
+- Total Deletions: -{total_deletions} lines
+- Net Change Volume: {total_changes} lines modified"""
+
+_SUMMARY_ONLY_STATS = (
+    "\n- DATA LIMITATION: Only summary stats available (user is viewing Conversation tab, not Files tab)"
+    "\n- NOTE: Individual file names and per-file breakdowns not available - focus analysis on overall change volume and patterns from title/description"
+)
+
+_INDIVIDUAL_FILES_NOTE = "Individual file names ARE available - cite specific files from the list above."
+_SUMMARY_ONLY_NOTE = "ONLY SUMMARY DATA AVAILABLE (Conversation tab view) - You have: total file count, additions/deletions, but NOT individual file names. Infer changes from PR TITLE, DESCRIPTION, and total change volume. Example: If title says 'Fix ESLint rule for refs', discuss ESLint rule changes specifically even without file names."
+
+
+class _InvalidJSONResponse(Exception):
+    """Groq returned (or rejected in JSON mode) a response that isn't a valid PRContext object"""
+    
+    def __init__(self, message: str, content: str):
+        super().__init__(message)
+        self.content = content
+
+
+def _json_validate_failure(e: BadRequestError) -> Optional[str]:
+    """
+    Return the failed generation if Groq rejected its own output as invalid JSON
+    
+    In JSON mode, invalid or truncated output comes back as HTTP 400 with
+    code "json_validate_failed" instead of as unparseable content.
+    Returns None for any other bad request.
+    """
+    body = e.body
+    error = body.get("error", body) if isinstance(body, dict) else None
+    if not isinstance(error, dict) or error.get("code") != "json_validate_failed":
+        return None
+    return error.get("failed_generation") or ""
+
+
+class _TopLevelFieldParser:
+    """
+    Incremental parser for a streamed JSON object
+    
+    Feed raw text chunks; each call returns the (key, value) pairs of
+    top-level fields that closed within that chunk. Nested values are
+    only decoded once complete.
+    """
+    
+    def __init__(self):
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._key_start: Optional[int] = None
+        self._value_start: Optional[int] = None
+    
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return any top-level fields it completed"""
+        self._text += chunk
+        text = self._text
+        completed: List[Tuple[str, Any]] = []
+        
+        for i in range(self._pos, len(text)):
+            ch = text[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = orjson.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                continue
+            
+            if ch == '"':
+                self._in_string = True
+                # A string at depth 1 before any ':' is a key
+                if self._depth == 1 and self._key is None and self._value_start is None:
+                    self._key_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 1:
+                    self._complete_field(text, i, completed)
+                self._depth -= 1
+            elif ch == ":" and self._depth == 1 and self._key is not None and self._value_start is None:
+                self._value_start = i + 1
+            elif ch == "," and self._depth == 1:
+                self._complete_field(text, i, completed)
+        
+        self._pos = len(text)
+        return completed
+    
+    def _complete_field(self, text: str, end: int, completed: List[Tuple[str, Any]]):
+        """Decode the value that just ended at `end` and reset for the next key"""
+        if self._key is not None and self._value_start is not None:
+            try:
+                completed.append((self._key, orjson.loads(text[self._value_start:end])))
+            except orjson.JSONDecodeError:
+                pass
+        self._key = None
+        self._value_start = None
+
 
 class GroqService:
     """Service to interact with Groq AI API"""
     
     def __init__(self):
         """Initialize Groq client"""
+        settings = get_settings()
         if not settings.GROQ_API_KEY or settings.GROQ_API_KEY == "your_groq_api_key_here":
             raise ValueError(
                 "GROQ_API_KEY not configured. "
                 "Get your free API key from https://console.groq.com"
             )
         
-        self.client = Groq(api_key=settings.GROQ_API_KEY)
+        # SDK handles retries/backoff (incl. Retry-After) over a pooled httpx client
+        self.client = AsyncGroq(
+            api_key=settings.GROQ_API_KEY,
+            max_retries=3,
+            timeout=httpx.Timeout(30.0, connect=5.0)
+        )
         self.model = settings.GROQ_MODEL
-        logger.info(f"Groq service initialized with model: {self.model}")
+        # Caps concurrent Groq calls across all requests (single, batch and fan-out)
+        self._sem = asyncio.Semaphore(settings.GROQ_MAX_CONCURRENCY)
+        # Parsed analyses keyed by PR content hash (the app-wide result cache)
+        self._cache = get_cache_service()
+        # In-flight analyses by the same key, so duplicate requests share one Groq call
+        self._inflight: Dict[str, asyncio.Task] = {}
+        # Built prompts by the same key, reused when a result expired or wasn't cached
+        self._prompts: LRUCache = LRUCache(maxsize=256)
+        # Optional Redis cache shared by all workers; client is created on first use
+        self._redis_url = settings.REDIS_URL
+        self._redis_ttl = settings.REDIS_TTL
+        self._redis = None
+        self._redis_down_until = 0.0
+        if self._redis_url and aioredis is None:
+            logger.warning("REDIS_URL is set but the redis package is not installed; shared cache disabled")
+        logger.info("Groq service initialized with model: %s", self.model)
+    
+    def _get_redis(self):
+        """Return the Redis client, or None if not configured or recently unreachable"""
+        if aioredis is None or not self._redis_url:
+            return None
+        if time.monotonic() < self._redis_down_until:
+            return None
+        if self._redis is None:
+            # Short timeouts: a slow Redis must never hold up an analysis
+            self._redis = aioredis.from_url(
+                self._redis_url,
+                socket_connect_timeout=0.5,
+                socket_timeout=0.5
+            )
+        return self._redis
+    
+    def _redis_failed(self, e: Exception):
+        """Log a Redis error and bypass Redis for a while"""
+        logger.warning("Redis cache unavailable, bypassing for %.0fs: %s", _REDIS_RETRY_SECONDS, e)
+        self._redis_down_until = time.monotonic() + _REDIS_RETRY_SECONDS
     
-    def _build_analysis_prompt(self, pr_data: PRAnalyzeRequest) -> str:
-        """Build EXPERT-LEVEL prompt for TOP 1% PR analysis"""
+    async def _get_shared(self, cache_key: str, pr_title: str) -> Optional[PRContext]:
+        """Look up an analysis stored by any worker; promotes hits into the local cache"""
+        redis = self._get_redis()
+        if redis is None:
+            return None
+        try:
+            cached = await redis.get(f"prctx:{cache_key}")
+        except Exception as e:
+            self._redis_failed(e)
+            return None
+        if cached is None:
+            return None
         
-        # Analyze files with DEEP INSIGHTS
+        try:
+            context = PRContext.model_validate_json(cached)
+        except ValueError as e:
+            logger.warning("Ignoring invalid shared cache entry %s: %s", cache_key, e)
+            return None
+        self._cache.set_with_key(cache_key, context, pr_title)
+        return context
+    
+    async def _remember(self, cache_key: str, context: PRContext, pr_title: str):
+        """Cache a successful analysis locally and, if configured, in Redis"""
+        self._cache.set_with_key(cache_key, context, pr_title)
+        redis = self._get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.set(f"prctx:{cache_key}", context.model_dump_json(), ex=self._redis_ttl)
+        except Exception as e:
+            self._redis_failed(e)
+    
+    def _build_analysis_prompt_cached(
+        self,
+        key_hash: str,
+        pr_data: PRAnalyzeRequest,
+        file_notes: Optional[List[str]] = None
+    ) -> str:
+        """
+        Build the user message, memoized on the PR's generate_cache_key() hash
+        
+        Prompts that include per-file notes are built fresh, since the
+        notes come from separate (non-deterministic) Groq calls.
+        """
+        if file_notes:
+            return self._build_analysis_prompt(pr_data, file_notes)
+        
+        prompt = self._prompts.get(key_hash)
+        if prompt is None:
+            prompt = self._build_analysis_prompt(pr_data)
+            self._prompts[key_hash] = prompt
+        return prompt
+    
+    def _build_analysis_prompt(self, pr_data: PRAnalyzeRequest, file_notes: Optional[List[str]] = None) -> str:
+        """
+        Build the PR-specific user message for analysis
+        
+        Only per-PR data goes here; the expert instructions and JSON schema
+        are sent separately as _STATIC_SYSTEM_PROMPT.
+        """
+        
+        # Analyze files with DEEP INSIGHTS - single pass for totals, types,
+        # large changes, the shown file list and the summary-data check
         files_summary = []
         total_additions = 0
         total_deletions = 0
         file_types = {}
         large_changes = []
+        has_individual_files = False
         
-        for i, file in enumerate(pr_data.files[:30], 1):  # Increased to 30
-            files_summary.append(
-                f"  {i}. {file.filename} ({file.status}): "
-                f"+{file.additions}/-{file.deletions}"
-            )
-            total_additions += file.additions
-            total_deletions += file.deletions
+        for i, file in enumerate(pr_data.files):
+            filename = file.filename
+            additions = file.additions
+            deletions = file.deletions
+            total_additions += additions
+            total_deletions += deletions
+            
+            if i < 30:  # Increased to 30
+                files_summary.append(
+                    f"  {i + 1}. {filename} ({file.status}): "
+                    f"+{additions}/-{deletions}"
+                )
+            
+            # Detect if we only have summary data (not individual files)
+            if i < 5 and not has_individual_files:
+                has_individual_files = not filename.startswith(_SUMMARY_PREFIXES)
             
             # Track patterns for intelligent analysis
-            ext = file.filename.split('.')[-1] if '.' in file.filename else 'unknown'
+            _, dot, ext = filename.rpartition('.')
+            if not dot or not ext or '/' in ext:  # no extension, or the dot is in a directory name
+                ext = 'unknown'
             file_types[ext] = file_types.get(ext, 0) + 1
             
-            if file.additions + file.deletions > 500:
-                large_changes.append(f"{file.filename} ({file.additions + file.deletions} lines)")
+            if additions + deletions > 500:
+                large_changes.append(f"{filename} ({additions + deletions} lines)")
         
         if len(pr_data.files) > 30:
             files_summary.append(f"  ... and {len(pr_data.files) - 30} more files")
         
         # Analyze commits for patterns
-        commits_summary = []
-        for i, commit in enumerate(pr_data.commits[:15], 1):  # Increased to 15
-            commits_summary.append(f"  {i}. {commit.message[:150]}")
+        commits_summary = [
+            f"  {i}. {commit.message[:150]}"
+            for i, commit in enumerate(pr_data.commits[:15], 1)  # Increased to 15
+        ]
         
         if len(pr_data.commits) > 15:
             commits_summary.append(f"  ... and {len(pr_data.commits) - 15} more commits")
         
         # Build INTELLIGENT stats summary
-        # Detect if we only have summary data (not individual files)
-        has_individual_files = any(not f.filename.startswith('[') and not f.filename.startswith('SUMMARY') and not f.filename.startswith('LIMITATION') and not f.filename.startswith('ℹ️') for f in pr_data.files[:5])
-        
-        stats_section = f"""
-📊 CODE CHANGE STATISTICS:
-- Total Files: {len(pr_data.files)} files
-- Total Additions: +{total_additions} lines  
-- Total Deletions: -{total_deletions} lines
-- Net Change Volume: {total_additions + total_deletions} lines modified"""
+        n_files = len(pr_data.files)
+        stats_section = _STATS_TEMPLATE.format_map({
+            "n_files": n_files,
+            "total_additions": total_additions,
+            "total_deletions": total_deletions,
+            "total_changes": total_additions + total_deletions
+        })
         
         if has_individual_files:
             file_types_str = ', '.join([f'{k}({v})' for k, v in sorted(file_types.items(), key=lambda x: -x[1])[:5]])
             stats_section += f"\n- File Types: {file_types_str}"
             if large_changes:
-                stats_section += f"\n- ⚠️ Large Changes (>500 lines): {', '.join(large_changes[:3])}"
+                stats_section += f"\n- Large Changes (>500 lines): {', '.join(large_changes[:3])}"
         else:
-            stats_section += "\n- ⚠️ DATA LIMITATION: Only summary stats available (user is viewing Conversation tab, not Files tab)"
-            stats_section += "\n- NOTE: Individual file names and per-file breakdowns not available - focus analysis on overall change volume and patterns from title/description"
+            stats_section += _SUMMARY_ONLY_STATS
         
-        # Build EXPERT-LEVEL prompt
-        prompt = f"""🎯 You are a SENIOR STAFF ENGINEER at a top tech company (Google/Meta/Amazon level). You're performing an EXPERT code review that will guide critical engineering decisions. Your analysis must be SPECIFIC, PROFESSIONAL, and ACTIONABLE - absolutely NO generic advice.
-
-═══════════════════════════════════════════════════════════════
-📝 PULL REQUEST CONTEXT
-═══════════════════════════════════════════════════════════════
-Title: {pr_data.title}
-Description: {pr_data.description[:1500] if pr_data.description else "No description provided"}
-Base Branch: {pr_data.base_branch}
-Head Branch: {pr_data.head_branch}
-
-{stats_section}
-
-📂 FILES CHANGED ({len(pr_data.files)} files):
-{chr(10).join(files_summary)}
-
-📋 COMMITS ({len(pr_data.commits)} commits):
-{chr(10).join(commits_summary) if commits_summary else "No commits information"}
-
-═══════════════════════════════════════════════════════════════
-🔍 EXPERT ANALYSIS REQUIREMENTS
-═══════════════════════════════════════════════════════════════
-
-✅ MUST BE:
-• SPECIFIC to THIS PR (cite actual files when available, or infer from title/description)
-• INSIGHTFUL (show architectural thinking, not obvious observations)
-• ACTIONABLE (concrete steps, not vague advice like "test thoroughly")
-• PROFESSIONAL (technical precision, industry terminology)
-
-❌ NEVER SAY:
-• Generic advice ("ensure proper testing", "check for bugs")
-• Obvious statements ("files were modified", "code changed")
-• Vague warnings ("could have issues", "might cause problems")
-• "0 lines" or "change volume is 0" when stats show otherwise
-❌ BE SPECIFIC OR DON'T MENTION IT
-
-⚠️ IMPORTANT - DATA CONTEXT:
-{f"Individual file names ARE available - cite specific files from the list above." if has_individual_files else "⚠️ ONLY SUMMARY DATA AVAILABLE (Conversation tab view) - You have: total file count, additions/deletions, but NOT individual file names. Infer changes from PR TITLE, DESCRIPTION, and total change volume. Example: If title says 'Fix ESLint rule for refs', discuss ESLint rule changes specifically even without file names."}
-
-Respond with EXPERT JSON analysis:
-{{
-  "summary": "2-3 sentences citing ACTUAL NUMBERS from 'CODE CHANGE STATISTICS' above ({total_additions}+ additions, {total_deletions}- deletions across {len(pr_data.files)} files). {f'Mention specific files from FILES CHANGED list.' if has_individual_files else 'Since file names unavailable, infer changes from PR title/description.'} Example: '{len(pr_data.files)} files modified with {total_additions + total_deletions} total line changes, focusing on [infer from title] ...'",
-  
-  "purpose": "The ACTUAL technical problem being solved (cite issue numbers from description if present). Example: 'Fixes Issue #XXXXX where [specific problem from title/description]'",
-  
-  "testing_focus": [
-    "SPECIFIC test scenario 1 based on actual changes (e.g., 'Open chat in untitled file, verify session initializes without null errors')",
-    "SPECIFIC scenario 2 with edge case (e.g., 'Rename file during active session, confirm sessionId persists correctly')",
-    "SPECIFIC scenario 3 for regression (e.g., 'Test existing saved-file workflow unchanged')"
-  ],
-  
-  "potential_risks": [
-    "SPECIFIC technical risk from THIS PR (e.g., 'Session API breaking change: sessionId now nullable during init - may break extensions expecting immediate ID')",
-    "SPECIFIC concern with file reference (e.g., 'Large refactor in ErrorHandler.ts could introduce uncaught exceptions in error-handling code itself')"
-  ],
-  
-  "affected_areas": [
-    "Specific module/file with role (e.g., 'ChatSessionsService.ts - core session lifecycle')",
-    "API/component changed (e.g., 'POST /api/sessions endpoint - validates sessionId')",
-    "Database/state impact (e.g., 'Session storage schema - adds optional fallback_id field')"
-  ],
-  
-  "review_priority": "HIGH/MEDIUM/LOW/CRITICAL with detailed justification. MUST reference actual change volume ({total_additions + total_deletions} lines, {len(pr_data.files)} files). Example: 'MEDIUM - Modifies {len(pr_data.files)} files with {total_additions + total_deletions} line changes in [area from title], affecting [component] with [risk level]'",
-  
-  "estimated_review_time": "Realistic minutes based on {total_additions + total_deletions} lines changed. Formula: <200 lines: 10-20min | 200-500: 20-40min | 500-1000: 40-70min | >1000: 70-120min. Adjust for complexity from title/description.",
-  
-  "key_changes": [
-    "SPECIFIC technical change with file + impact (e.g., 'ChatSessionsService.ts: Adds async initSession() method with null-check, replaces sync constructor pattern - breaking change for direct instantiation')",
-    "SPECIFIC change explaining architecture (e.g., 'Introduces SessionValidator middleware (+200 lines) enforcing sessionId validation before all API calls - new security layer')",
-    "SPECIFIC change about performance/security (e.g., 'Removes N+1 query in getActiveSessions() by adding eager loading - 10x performance improvement')",
-    "Continue with 2-5 more SPECIFIC items..."
-  ]
-}}
-
-🔥 CRITICAL INSTRUCTIONS:
-1. **USE ACTUAL NUMBERS**: STATS section shows {total_additions}+ additions, {total_deletions}- deletions, {total_additions + total_deletions} total lines - REFERENCE THESE EXACT NUMBERS in your analysis
-2. **NEVER SAY**: "0 lines", "change volume is 0", "no files modified" when stats show otherwise
-3. Use PR TITLE and DESCRIPTION to infer WHAT changed even if file names unavailable  
-4. Cite ACTUAL FILES when available from FILES CHANGED list
-5. Be SPECIFIC or don't mention it - NO generic advice whatsoever
-6. {f"You have individual file names - use them!" if has_individual_files else "File names unavailable - infer from title/description/change volume"}
-
-Return ONLY valid JSON. NO markdown, NO code blocks, NO extra text. Just the JSON object."""
-
-        return prompt
+        # Per-file notes from concurrent fan-out (large PRs only)
+        file_notes_section = ""
+        if file_notes:
+            file_notes_section = "\n\nPER-FILE NOTES:\n" + "\n".join(f"  - {note}" for note in file_notes)
+        
+        # PR-specific user message; the static instructions live in _STATIC_SYSTEM_PROMPT
+        return _PROMPT_TEMPLATE.format_map({
+            "title": pr_data.title,
+            "description": pr_data.description[:1500] if pr_data.description else "No description provided",
+            "base_branch": pr_data.base_branch,
+            "head_branch": pr_data.head_branch,
+            "stats_section": stats_section,
+            "n_files": n_files,
+            "files_text": "\n".join(files_summary),
+            "file_notes_section": file_notes_section,
+            "n_commits": len(pr_data.commits),
+            "commits_text": "\n".join(commits_summary) if commits_summary else "No commits information",
+            "data_context": _INDIVIDUAL_FILES_NOTE if has_individual_files else _SUMMARY_ONLY_NOTE
+        })
     
-    async def analyze_pr(self, pr_data: PRAnalyzeRequest, max_retries: int = 3) -> PRContext:
+    async def analyze_pr(self, pr_data: PRAnalyzeRequest, cache_key: Optional[str] = None) -> PRContext:
         """
-        Analyze PR using Groq AI with retry logic and exponential backoff
+        Analyze PR using Groq AI
+        
+        Transient API failures are retried by the Groq SDK (max_retries on the
+        client, honoring Retry-After) over its pooled connection.
         
         Args:
             pr_data: PR data to analyze
-            max_retries: Maximum number of retry attempts (default: 3)
+            cache_key: generate_cache_key() of the PR if the caller already has it
             
         Returns:
             PRContext with analysis results
             
         Raises:
-            ValueError: If analysis fails after all retries
-            GroqError: If Groq API call fails permanently
+            ValueError: If the Groq API call fails after the SDK's retries
+        """
+        return await self._analyze_single_flight(pr_data, cache_key)
+    
+    async def _analyze_single_flight(
+        self,
+        pr_data: PRAnalyzeRequest,
+        cache_key: Optional[str] = None,
+        fan_out_files: int = 0,
+        fan_out_concurrency: int = 5
+    ) -> PRContext:
+        """Serve from cache, or join/start the one analysis task for this PR"""
+        trivial = self._trivial_context(pr_data)
+        if trivial is not None:
+            return trivial
+        
+        if cache_key is None:
+            cache_key = self._cache.generate_cache_key(pr_data)
+        cached = self._cache.get_by_key(cache_key)
+        if cached is not None:
+            logger.info("Returning cached analysis for PR: %s", pr_data.title)
+            return cached
+        
+        # Single-flight: join an identical analysis that's already running.
+        # The work runs in its own task (shielded), so a cancelled caller
+        # doesn't cancel the Groq call other callers are waiting on.
+        task = self._inflight.get(cache_key)
+        if task is None:
+            task = asyncio.ensure_future(
+                self._analyze_uncached(pr_data, cache_key, fan_out_files, fan_out_concurrency)
+            )
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cache_key, None))
+        else:
+            logger.info("Joining in-flight analysis for PR: %s", pr_data.title)
+        
+        return await asyncio.shield(task)
+    
+    def _completion_params(self, prompt: str, system_prompt: str, json_mode: bool = True) -> Dict[str, Any]:
+        """
+        Keyword arguments shared by streamed and non-streamed analysis calls
+        
+        Groq's JSON mode doesn't support streaming, so streamed calls pass
+        json_mode=False and rely on the system prompt plus the fallback.
+        """
+        params = dict(
+            model=self.model,
+            messages=[
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            temperature=0.3,  # Lower temperature for more consistent output
+            max_tokens=1000,  # Schema output rarely exceeds this; fewer tokens = faster decode
+            top_p=0.9
+        )
+        if json_mode:
+            params["response_format"] = {"type": "json_object"}  # JSON mode: server guarantees valid JSON
+        return params
+    
+    async def _complete(self, prompt: str, system_prompt: str) -> str:
+        """Run one analysis completion and return the raw message content"""
+        async with self._sem:
+            response = await self.client.chat.completions.create(
+                **self._completion_params(prompt, system_prompt)
+            )
+        
+        content = response.choices[0].message.content.strip()
+        logger.debug("Groq response length: %d characters", len(content))
+        if response.usage is not None:
+            logger.debug(
+                "Groq usage: %d prompt tokens, %d completion tokens",
+                response.usage.prompt_tokens, response.usage.completion_tokens
+            )
+        return content
+    
+    async def _complete_context(self, prompt: str, system_prompt: str) -> PRContext:
+        """
+        Run one analysis completion and parse it into PRContext
+        
+        Raises:
+            _InvalidJSONResponse: If the response isn't a valid PRContext object
+                (including Groq's own json_validate_failed rejection)
         """
-        last_error = None
+        try:
+            content = await self._complete(prompt, system_prompt)
+        except BadRequestError as e:
+            failed_generation = _json_validate_failure(e)
+            if failed_generation is None:
+                raise
+            raise _InvalidJSONResponse(str(e), failed_generation) from e
         
-        for attempt in range(max_retries):
+        try:
+            return self._parse_context(content)
+        except (orjson.JSONDecodeError, ValidationError, TypeError) as e:
+            raise _InvalidJSONResponse(str(e), content) from e
+    
+    @staticmethod
+    def _parse_context(content: str) -> PRContext:
+        """
+        Parse a Groq response into PRContext
+        
+        Raises:
+            orjson.JSONDecodeError: If the content is not valid JSON
+            TypeError: If the JSON is not an object
+            ValidationError: If fields are missing or have the wrong type
+        """
+        # Defensive: remove markdown code blocks if present (not expected in JSON mode)
+        if content.startswith("```json"):
+            content = content[7:]
+        if content.startswith("```"):
+            content = content[3:]
+        if content.endswith("```"):
+            content = content[:-3]
+        content = content.strip()
+        
+        analysis_data = orjson.loads(content)
+        
+        # Validate and create PRContext (model output is untrusted: types are
+        # checked here so bad values never reach clients or the shared cache)
+        return PRContext(**analysis_data)
+    
+    async def _analyze_uncached(
+        self,
+        pr_data: PRAnalyzeRequest,
+        cache_key: str,
+        fan_out_files: int,
+        fan_out_concurrency: int
+    ) -> PRContext:
+        """Run the Groq call(s) and cache the parsed result"""
+        shared = await self._get_shared(cache_key, pr_data.title)
+        if shared is not None:
+            logger.info("Returning shared cached analysis for PR: %s", pr_data.title)
+            return shared
+        
+        try:
+            file_notes = None
+            if fan_out_files:
+                file_notes = await self._summarize_files(pr_data, fan_out_files, fan_out_concurrency)
+            
+            prompt = self._build_analysis_prompt_cached(cache_key, pr_data, file_notes)
+            
+            logger.info("Analyzing PR: %s", pr_data.title)
+            logger.debug("Prompt length: %d characters", len(prompt))
+            
             try:
-                prompt = self._build_analysis_prompt(pr_data)
-                
-                logger.info(f"Analyzing PR (attempt {attempt + 1}/{max_retries}): {pr_data.title}")
-                logger.debug(f"Prompt length: {len(prompt)} characters")
-                
-                # Call Groq API
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {
-                            "role": "system",
-                            "content": "You are an expert code reviewer. Respond only with valid JSON."
-                        },
-                        {
-                            "role": "user",
-                            "content": prompt
-                        }
-                    ],
-                    temperature=0.3,  # Lower temperature for more consistent output
-                    max_tokens=2000,
-                    top_p=0.9
-                )
-                
-                # Extract response
-                content = response.choices[0].message.content.strip()
-                logger.debug(f"Groq response length: {len(content)} characters")
+                context = await self._complete_context(prompt, _STATIC_SYSTEM_PROMPT)
+            except _InvalidJSONResponse as e:
+                logger.error("Failed to parse JSON response: %s", e)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug("Raw response: %s", e.content)
                 
-                # Parse JSON response
+                # Single re-ask with a stricter system message, then fall back
+                logger.warning("Re-asking once with stricter JSON instructions")
                 try:
-                    # Remove markdown code blocks if present
-                    if content.startswith("```json"):
-                        content = content[7:]
-                    if content.startswith("```"):
-                        content = content[3:]
-                    if content.endswith("```"):
-                        content = content[:-3]
-                    content = content.strip()
-                    
-                    analysis_data = json.loads(content)
-                    
-                    # Validate and create PRContext
-                    context = PRContext(**analysis_data)
-                    logger.info(f"PR analysis completed successfully on attempt {attempt + 1}")
-                    return context
-                    
-                except json.JSONDecodeError as e:
-                    logger.error(f"Failed to parse JSON response: {e}")
-                    logger.error(f"Raw response: {content}")
-                    
-                    # If this is the last attempt, use fallback
-                    if attempt == max_retries - 1:
-                        logger.warning("All retries exhausted, using fallback context")
-                        return self._create_fallback_context(pr_data, content)
-                    
-                    # Otherwise, retry
-                    last_error = e
-                    continue
-                
-            except GroqError as e:
-                logger.error(f"Groq API error on attempt {attempt + 1}: {e}")
-                last_error = e
-                
-                # Check if it's a rate limit error
-                error_str = str(e).lower()
-                if "rate limit" in error_str or "quota" in error_str:
-                    logger.warning("Rate limit detected, longer wait before retry")
-                    if attempt < max_retries - 1:
-                        wait_time = min(2 ** (attempt + 2), 30)  # Up to 30 seconds for rate limits
-                        logger.info(f"Rate limit backoff: waiting {wait_time}s before retry {attempt + 2}")
-                        time.sleep(wait_time)
+                    context = await self._complete_context(prompt, _STATIC_SYSTEM_PROMPT + _STRICT_JSON_REMINDER)
+                except _InvalidJSONResponse as e:
+                    logger.error("Failed to parse JSON response on re-ask: %s", e)
+                    logger.warning("Using fallback context")
+                    return self._create_fallback_context(pr_data, e.content)
+            
+        except RateLimitError as e:
+            logger.error("Groq API rate limit after SDK retries: %s", e)
+            raise ValueError(_RATE_LIMIT_MESSAGE)
+        except GroqError as e:
+            logger.error("Groq API error after SDK retries: %s", e)
+            raise ValueError(f"AI analysis failed: {str(e)}")
+        except Exception as e:
+            logger.error("Unexpected error during PR analysis: %s", e, exc_info=True)
+            raise ValueError(f"Analysis failed: {str(e)}")
+        
+        logger.info("PR analysis completed successfully")
+        await self._remember(cache_key, context, pr_data.title)
+        return context
+    
+    async def analyze_pr_stream(
+        self,
+        pr_data: PRAnalyzeRequest,
+        cache_key: Optional[str] = None
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Analyze PR with a streamed Groq completion
+        
+        Yields ("field", (key, value)) as each top-level JSON field of the
+        response closes, so callers can render e.g. the summary while later
+        fields are still generating, then a final ("context", PRContext).
+        If the full response can't be parsed, the final event carries the
+        fallback context. cache_key is the PR's generate_cache_key(), if the
+        caller already has it.
+        
+        Raises:
+            ValueError: If the Groq API call fails after the SDK's retries
+        """
+        trivial = self._trivial_context(pr_data)
+        if trivial is not None:
+            yield "context", trivial
+            return
+        
+        if cache_key is None:
+            cache_key = self._cache.generate_cache_key(pr_data)
+        cached = self._cache.get_by_key(cache_key)
+        if cached is not None:
+            logger.info("Returning cached analysis for PR: %s", pr_data.title)
+            yield "context", cached
+            return
+        
+        shared = await self._get_shared(cache_key, pr_data.title)
+        if shared is not None:
+            logger.info("Returning shared cached analysis for PR: %s", pr_data.title)
+            yield "context", shared
+            return
+        
+        prompt = self._build_analysis_prompt_cached(cache_key, pr_data)
+        logger.info("Streaming analysis for PR: %s", pr_data.title)
+        
+        parser = _TopLevelFieldParser()
+        parts: List[str] = []
+        try:
+            async with self._sem:
+                stream = await self.client.chat.completions.create(
+                    **self._completion_params(prompt, _STATIC_SYSTEM_PROMPT, json_mode=False),
+                    stream=True
+                )
+                async for chunk in stream:
+                    delta = chunk.choices[0].delta.content if chunk.choices else None
+                    if not delta:
                         continue
-                    else:
-                        raise ValueError(
-                            "Groq API rate limit exceeded. Please try again in a few minutes. "
-                            "Free tier: 80,000 tokens/day, 30 requests/minute."
-                        )
-                
-                # Exponential backoff for other errors
-                if attempt < max_retries - 1:
-                    wait_time = min(2 ** attempt, 10)  # Max 10 seconds between retries
-                    logger.info(f"Waiting {wait_time}s before retry {attempt + 2}/{max_retries}")
-                    time.sleep(wait_time)
-                else:
-                    raise ValueError(f"AI analysis failed after {max_retries} attempts: {str(e)}")
-                    
+                    parts.append(delta)
+                    for field in parser.feed(delta):
+                        yield "field", field
+        except RateLimitError as e:
+            logger.error("Groq API rate limit after SDK retries: %s", e)
+            raise ValueError(_RATE_LIMIT_MESSAGE)
+        except GroqError as e:
+            logger.error("Groq API error after SDK retries: %s", e)
+            raise ValueError(f"AI analysis failed: {str(e)}")
+        
+        content = "".join(parts).strip()
+        try:
+            context = self._parse_context(content)
+        except (orjson.JSONDecodeError, ValidationError, TypeError) as e:
+            logger.error("Failed to parse streamed JSON response: %s", e)
+            context = self._create_fallback_context(pr_data, content)
+        else:
+            await self._remember(cache_key, context, pr_data.title)
+        
+        yield "context", context
+    
+    async def _summarize_file(self, file: PRFile, semaphore: asyncio.Semaphore) -> Optional[str]:
+        """Summarize a single file's diff; returns None if the call fails or the reply is empty"""
+        async with semaphore:
+            try:
+                async with self._sem:
+                    response = await self.client.chat.completions.create(
+                        model=self.model,
+                        messages=[
+                            {
+                                "role": "system",
+                                "content": "You are an expert code reviewer. Summarize the change in one or two sentences."
+                            },
+                            {
+                                "role": "user",
+                                "content": (
+                                    f"File: {file.filename} ({file.status}): +{file.additions}/-{file.deletions}\n\n"
+                                    f"{file.patch}"
+                                )
+                            }
+                        ],
+                        temperature=0.3,
+                        max_tokens=150
+                    )
+                content = (response.choices[0].message.content or "").strip()
+                if not content:
+                    logger.warning("Per-file summary for %s was empty", file.filename)
+                    return None
+                return f"{file.filename}: {content}"
+            except GroqError as e:
+                logger.warning("Per-file summary failed for %s: %s", file.filename, e)
+                return None
+    
+    async def analyze_files_concurrent(
+        self,
+        pr_data: PRAnalyzeRequest,
+        concurrency: int = 5,
+        max_files: int = 5,
+        cache_key: Optional[str] = None
+    ) -> PRContext:
+        """
+        Analyze a large PR by fanning out per-file summaries, then merging them
+        
+        The max_files largest files with a patch are summarized concurrently,
+        bounded by a semaphore, and the notes are passed into the regular
+        analysis prompt. Each summary is a separate Groq request, so keep
+        max_files well below the per-minute request limit. The fan-out runs
+        inside the single-flight task, so cached or duplicate requests for
+        the same PR never start it.
+        
+        Args:
+            pr_data: PR data to analyze
+            concurrency: Maximum number of in-flight per-file Groq calls
+            max_files: Maximum number of per-file Groq calls
+            cache_key: generate_cache_key() of the PR if the caller already has it
+            
+        Returns:
+            PRContext with analysis results
+        """
+        return await self._analyze_single_flight(
+            pr_data,
+            cache_key,
+            fan_out_files=max_files,
+            fan_out_concurrency=concurrency
+        )
+    
+    async def _summarize_files(self, pr_data: PRAnalyzeRequest, max_files: int, concurrency: int) -> List[str]:
+        """Summarize the largest patched files concurrently; failed summaries are skipped"""
+        semaphore = asyncio.Semaphore(concurrency)
+        files = heapq.nlargest(
+            max_files,
+            (f for f in pr_data.files if f.patch),
+            key=lambda f: f.additions + f.deletions
+        )
+        
+        notes = await asyncio.gather(*[self._summarize_file(f, semaphore) for f in files])
+        file_notes = [note for note in notes if note]
+        logger.info("Collected %d/%d per-file summaries", len(file_notes), len(files))
+        return file_notes
+    
+    async def analyze_prs(
+        self,
+        prs: List[PRAnalyzeRequest],
+        cache_keys: Optional[List[str]] = None
+    ) -> AsyncIterator[Tuple[int, Union[PRContext, Exception]]]:
+        """
+        Analyze several PRs concurrently, yielding results as they finish
+        
+        Groq calls overlap up to GROQ_MAX_CONCURRENCY (shared with all other
+        requests); one failing PR doesn't affect the others. cache_keys, if
+        given, are the PRs' generate_cache_key() values in the same order.
+        
+        Yields:
+            (index into prs, PRContext or the exception raised for that PR)
+        """
+        async def run(index: int, pr_data: PRAnalyzeRequest):
+            try:
+                return index, await self.analyze_pr(pr_data, cache_keys[index] if cache_keys else None)
             except Exception as e:
-                logger.error(f"Unexpected error during PR analysis (attempt {attempt + 1}): {e}", exc_info=True)
-                last_error = e
-                
-                if attempt < max_retries - 1:
-                    wait_time = min(2 ** attempt, 10)
-                    logger.info(f"Waiting {wait_time}s before retry {attempt + 2}/{max_retries}")
-                    time.sleep(wait_time)
-                else:
-                    raise ValueError(f"Analysis failed after {max_retries} attempts: {str(e)}")
-        
-        # Should never reach here, but just in case
-        raise ValueError(f"Analysis failed: {str(last_error)}")
+                return index, e
+        
+        for next_done in asyncio.as_completed([run(i, pr) for i, pr in enumerate(prs)]):
+            yield await next_done
+    
+    def _trivial_context(self, pr_data: PRAnalyzeRequest) -> Optional[PRContext]:
+        """
+        Build a deterministic context for trivial PRs, or None if the PR needs AI review
+        
+        A PR is trivial when it touches at most _TRIVIAL_MAX_FILES files, changes
+        fewer than _TRIVIAL_MAX_CHANGES lines and every file is documentation or
+        an image (e.g. a README typo).
+        """
+        files = pr_data.files
+        if len(files) > _TRIVIAL_MAX_FILES:
+            return None
+        
+        total_changes = sum(f.additions + f.deletions for f in files)
+        if total_changes >= _TRIVIAL_MAX_CHANGES:
+            return None
+        if any(
+            f.filename.startswith(_SUMMARY_PREFIXES)
+            or os.path.splitext(f.filename)[1].lower() not in _DOC_EXTS
+            for f in files
+        ):
+            return None
+        
+        logger.info("Trivial PR, skipping AI analysis: %s", pr_data.title)
+        
+        filenames = ", ".join(f.filename for f in files)
+        return PRContext(
+            summary=f"Small documentation change: {total_changes} lines across {len(files)} file(s) ({filenames}).",
+            purpose=pr_data.description[:200] if pr_data.description else pr_data.title,
+            testing_focus=[f"Check that {f.filename} renders/loads as expected" for f in files],
+            potential_risks=["Low risk: only documentation files changed"],
+            affected_areas=sorted({f.filename.split('/')[0] for f in files}),
+            review_priority="low",
+            estimated_review_time="5 minutes",
+            key_changes=[f"{f.filename} ({f.status}, +{f.additions}/-{f.deletions})" for f in files]
+        )
     
     def _create_fallback_context(self, pr_data: PRAnalyzeRequest, raw_response: str) -> PRContext:
         """Create fallback context if JSON parsing fails"""
@@ -327,11 +871,14 @@ Return ONLY valid JSON. NO markdown, NO code blocks, NO extra text. Just the JSO
 
 # Singleton instance
 _groq_service: Optional[GroqService] = None
+_groq_lock = threading.Lock()
 
 
 def get_groq_service() -> GroqService:
-    """Get or create Groq service instance"""
+    """Get or create Groq service instance (double-checked, so only one client is ever built)"""
     global _groq_service
     if _groq_service is None:
-        _groq_service = GroqService()
+        with _groq_lock:
+            if _groq_service is None:
+                _groq_service = GroqService()
     return _groq_service
@@ -85,7 +85,8 @@ class StartupValidator:
     def _validate_configuration(self):
         """Validate app configuration is valid"""
         try:
-            from app.config import settings
+            from app.config import get_settings
+            settings = get_settings()
             
             # Check critical settings
             if not settings.GROQ_API_KEY or settings.GROQ_API_KEY == "":
@@ -141,7 +142,8 @@ class StartupValidator:
     def _check_configuration_security(self):
         """Check for insecure configuration"""
         try:
-            from app.config import settings
+            from app.config import get_settings
+            settings = get_settings()
             
             # Warn if using default/placeholder values
             if settings.GROQ_API_KEY and 'your_' in settings.GROQ_API_KEY.lower():
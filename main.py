@@ -5,11 +5,14 @@ FastAPI server with Groq AI integration and autonomous agent system
 
 import os
 import sys
+import asyncio
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from datetime import datetime
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, ORJSONResponse
 from slowapi import Limiter, _rate_limit_exceeded_handler
 from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
@@ -19,7 +22,9 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import config BEFORE using settings
-from app.config import settings
+from app.config import get_settings
+
+settings = get_settings()
 
 # Import routers
 from app.routers import analyze
@@ -47,20 +52,43 @@ if not HAS_AGENT_ROUTES:
 
 # Rate limiter (with error handling)
 try:
-    limiter = Limiter(key_func=get_remote_address)
+    limiter = Limiter(key_func=get_remote_address, storage_uri=settings.RATE_LIMIT_STORAGE_URI)
 except Exception as e:
     logger.error(f"Failed to initialize rate limiter: {e}")
     logger.warning("Starting without rate limiting (not recommended for production)")
     limiter = None
 
 
-# Initialize FastAPI app (without lifespan for serverless compatibility)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Warm up the Groq client at startup so the first request doesn't pay for it
+    
+    Best-effort only: serverless runtimes may skip lifespan events, and the
+    services are still created lazily on first use.
+    """
+    from app.services import get_cache_service, get_groq_service
+    
+    # Agents run their sync Groq calls via asyncio.to_thread
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=32))
+    
+    get_cache_service()
+    try:
+        get_groq_service()
+    except ValueError as e:
+        logger.warning(f"Groq service not initialized at startup: {e}")
+    yield
+
+
+# Initialize FastAPI app (lifespan is a warm-up only, so serverless deploys still work without it)
 app = FastAPI(
     title="PR Context Generator API",
     description="AI-powered GitHub PR context analysis using Groq",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add rate limiter (if available)
@@ -74,8 +102,9 @@ app.add_middleware(
     allow_origin_regex=r"chrome-extension://.*",
     allow_credentials=True,
     allow_methods=["GET", "POST", "OPTIONS"],
-    allow_headers=["*"],
-    expose_headers=["*"]
+    # Only what the extension sends; If-None-Match/ETag carry /analyze revalidation
+    allow_headers=["Content-Type", "Authorization", "X-Request-ID", "If-None-Match"],
+    expose_headers=["ETag"]
 )
 
 